@@ -1,3 +1,9 @@
 from .converter import Converter
-from .utils import file_generator, configure_logging, handle_signal
+from .utils import (
+    file_generator,
+    configure_logging,
+    handle_signal,
+    available_cpu_count,
+    prefetch_files,
+)
 from .config import parse_arguments
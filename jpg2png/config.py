@@ -1,6 +1,25 @@
 import argparse
 
 
+def _reducing_gap(value: str) -> float:
+    """
+    Parse a Pillow `reducing_gap` value, which must be at least 1.0.
+
+    Args:
+        value (str): Command line value.
+
+    Returns:
+        float: Parsed reducing gap.
+    """
+    try:
+        gap: float = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number: {value}")
+    if gap < 1.0:
+        raise argparse.ArgumentTypeError(f"must be at least 1.0, got {value}")
+    return gap
+
+
 def parse_arguments() -> argparse.Namespace:
     """
     Parse command line arguments.
@@ -25,19 +44,19 @@ def parse_arguments() -> argparse.Namespace:
     parser.add_argument(
         "--threads",
         type=int,
-        help="Number of threads to use for conversion (default: auto-detect)",
+        help="Number of worker processes to use for conversion, capped at the usable CPUs (default: auto-detect)",
     )
     parser.add_argument(
         "--retries",
         type=int,
         default=3,
-        help="Number of retries for conversion in case of failure (default: 3)",
+        help="Number of attempts for conversion in case of transient failure (default: 3)",
     )
     parser.add_argument(
         "--compression",
         type=int,
-        default=6,
-        help="Compression level for PNG output (0-9, default: 6)",
+        default=1,
+        help="Compression level for PNG output (0-9, default: 1); higher levels give smaller files at a much higher encoding cost",
     )
     parser.add_argument(
         "--log-level",
@@ -49,7 +68,7 @@ def parse_arguments() -> argparse.Namespace:
         "--retry-delay",
         type=int,
         default=1,
-        help="Delay between retries in seconds (default: 1)",
+        help="Delay before the first retry in seconds, doubled for each further retry (default: 1)",
     )
     parser.add_argument(
         "--dry-run",
@@ -67,5 +86,18 @@ def parse_arguments() -> argparse.Namespace:
         default=1,
         help="Upscale factor for the image resolution (default: 1, meaning no upscaling)",
     )
+    parser.add_argument(
+        "--reducing-gap",
+        type=_reducing_gap,
+        default=None,
+        help="Pillow reducing_gap (>= 1.0) for the Pillow resize fallback, used when neither cykooz.resizer nor the vips backend is; has no effect on pure upscales (default: disabled)",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        choices=["pil", "vips"],
+        default="pil",
+        help="Image processing backend; 'vips' needs pyvips and libvips (default: pil)",
+    )
 
     return parser.parse_args()
@@ -6,24 +6,160 @@ Classes:
     Converter: Handles the conversion process.
 """
 
+import errno
+import io
+import mmap
 import os
+import random
+import struct
 import time
+import warnings
 import logging
-from PIL import Image, ImageEnhance
+from functools import partial
+from typing import Any, BinaryIO, Callable, Dict, FrozenSet, List, Optional, Tuple, Union
+import numpy as np
+from PIL import Image, ImageEnhance, UnidentifiedImageError
+
+from .kernels import LUMA_WEIGHTS, SHARPEN_DIVISOR, SHARPEN_KERNEL, enhance
+from .utils import FileData, read_file
+
+try:
+    from cykooz_resizer import (
+        FilterType,
+        ImageData,
+        PixelType,
+        ResizeAlg,
+        ResizeOptions,
+        Resizer,
+    )
+except ImportError:
+    Resizer = None
+
+try:
+    from turbojpeg import TJCS_CMYK, TJCS_GRAY, TJCS_YCCK, TJPF_GRAY, TJPF_RGB, TurboJPEG
+
+    _TURBOJPEG: Optional["TurboJPEG"] = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    # TurboJPEG() raises RuntimeError when the libturbojpeg library cannot be found.
+    _TURBOJPEG = None
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # pyvips raises OSError when the libvips shared library cannot be loaded.
+    pyvips = None
 
 logger: logging.Logger = logging.getLogger("jpg2png.converter")
 
+# SIMD (AVX2/SSE4.1/NEON) Lanczos3 resizer; the best CPU extension available
+# is selected by the resizer itself. Falls back to Pillow when not installed.
+_RESIZER: Optional["Resizer"] = Resizer() if Resizer is not None else None
+_RESIZE_OPTIONS: Optional["ResizeOptions"] = (
+    ResizeOptions(resize_alg=ResizeAlg.convolution(FilterType.lanczos3))
+    if Resizer is not None
+    else None
+)
+_SIMD_PIXEL_TYPES: Dict[str, "PixelType"] = (
+    {"L": PixelType.U8, "RGB": PixelType.U8x3, "RGBA": PixelType.U8x4}
+    if Resizer is not None
+    else {}
+)
+
+# Modes handled by the fused sharpen + contrast kernel; others use ImageEnhance.
+_FUSED_ENHANCE_MODES: Tuple[str, ...] = ("L", "RGB")
+# Modes of decoded JPEGs that PNG stores as is; the others (i.e. CMYK) become RGB.
+_PNG_NATIVE_MODES: Tuple[str, ...] = ("L", "RGB")
+# libvips counterparts of `_PNG_NATIVE_MODES`.
+_VIPS_NATIVE_INTERPRETATIONS: Tuple[str, ...] = ("b-w", "srgb")
+# Image modes of pixel buffers, keyed by their number of channels.
+_PIXEL_MODES: Dict[int, str] = {1: "L", 3: "RGB", 4: "RGBA"}
+_CONTRAST_FACTOR: float = 1.5
+
+BACKENDS: Tuple[str, ...] = ("pil", "vips")
+
+# OS errors worth retrying: resource exhaustion that may clear up by itself.
+_TRANSIENT_ERRNOS: FrozenSet[int] = frozenset(
+    {errno.EAGAIN, errno.EINTR, errno.EMFILE, errno.ENFILE, errno.ENOSPC, errno.EBUSY}
+)
+
+# Up to this compression level, the vips backend skips PNG row filtering entirely.
+_UNFILTERED_PNG_MAX_LEVEL: int = 3
+
+# Rough raw-to-PNG size ratio of photographic content, used to pre-size output files.
+_PNG_SIZE_RATIO: int = 2
+
+
+def _pixel_mode(arr: np.ndarray) -> str:
+    """
+    Get the PIL image mode matching a uint8 pixel buffer.
+
+    Args:
+        arr (np.ndarray): Pixel buffer of shape (height, width) or (height, width, channels).
+
+    Returns:
+        str: PIL image mode.
+    """
+    return _PIXEL_MODES[arr.shape[2] if arr.ndim == 3 else 1]
+
+
+def _open_source(file_path: str, data: Optional[FileData]) -> Union[str, BinaryIO]:
+    """
+    Get what `Image.open` should read a .jpg file from.
+
+    Args:
+        file_path (str): Path to the .jpg file.
+        data (Optional[FileData]): Contents of the .jpg file, read from `file_path` when None.
+
+    Returns:
+        Union[str, BinaryIO]: The path, or a file object over the prefetched contents.
+    """
+    if data is None:
+        return file_path
+    if isinstance(data, mmap.mmap):
+        data.seek(0)
+        return data
+    return io.BytesIO(data)
+
+
+def _pre_size_output(path: str, approx_bytes: int) -> int:
+    """
+    Open an output file for writing and reserve disk space for it up front.
+
+    Reserving the blocks in one call keeps the filesystem from growing the file
+    piecemeal while the encoder streams chunks into it. The caller is expected to
+    truncate the file to its final size once written.
+
+    Args:
+        path (str): Path to the file to open.
+        approx_bytes (int): Expected size of the file in bytes.
+
+    Returns:
+        int: File descriptor opened for writing.
+    """
+    fd: int = os.open(
+        path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644
+    )
+    if hasattr(os, "posix_fallocate") and approx_bytes > 0:
+        try:
+            os.posix_fallocate(fd, 0, approx_bytes)
+        except OSError:
+            # Not supported by every filesystem; the file simply grows as it is written.
+            pass
+    return fd
+
 
 class Converter:
     def __init__(
         self,
         output_directory: str,
         retries: int = 3,
-        compression_level: int = 6,
+        compression_level: int = 1,
         retry_delay: int = 1,
         dry_run: bool = False,
         improve: bool = False,
         upscale: int = 1,
+        reducing_gap: Optional[float] = None,
+        backend: str = "pil",
     ) -> None:
         self.output_directory: str = output_directory
         self.retries: int = retries
@@ -32,56 +168,369 @@ class Converter:
         self.dry_run: bool = dry_run
         self.improve: bool = improve
         self.upscale: int = upscale
+        self.reducing_gap: Optional[float] = reducing_gap
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+        if backend == "vips" and pyvips is None:
+            logger.warning("pyvips/libvips is not available, falling back to the PIL backend")
+            backend = "pil"
+        self.backend: str = backend
+        # The options are fixed for the lifetime of the converter, so the conversion
+        # path and its processing stages are picked once here instead of being
+        # re-checked for every file.
+        self._convert_fn: Callable[[str, str, Optional[FileData]], None]
+        if backend == "vips":
+            self._convert_fn = self.convert_vips
+        elif not improve and upscale <= 1:
+            self._convert_fn = self._transcode
+        else:
+            self._convert_fn = self._convert_pixels
+        # Stages applied in order to the decoded pixel buffer, or to the libvips image.
+        # Upscaling comes first so that the improvement runs once on the output size.
+        stages: List[Callable[[Any], Any]] = []
+        if upscale > 1:
+            stages.append(
+                partial(
+                    self.upscale_vips_image if backend == "vips" else self.upscale_pixels,
+                    factor=upscale,
+                )
+            )
+        if improve:
+            stages.append(
+                self.improve_vips_image
+                if backend == "vips"
+                else partial(enhance, contrast=_CONTRAST_FACTOR)
+            )
+        self._stages: Tuple[Callable[[Any], Any], ...] = tuple(stages)
+        if backend == "vips":
+            # Improving needs the mean gray level first, i.e. two passes over the pixels.
+            self._vips_access: str = "random" if improve else "sequential"
+            # Decoded JPEGs are noisy, so per-row filter selection buys little at low levels.
+            self._vips_png_filter: int = (
+                pyvips.enums.ForeignPngFilter.NONE
+                if compression_level <= _UNFILTERED_PNG_MAX_LEVEL
+                else pyvips.enums.ForeignPngFilter.ALL
+            )
 
-    def convert(self, file_path: str) -> bool:
+    def output_path(self, file_path: str) -> str:
         """
-        Convert a .jpg file to a .png file.
+        Get the path of the .png file a .jpg file is converted to.
 
         Args:
             file_path (str): Path to the .jpg file.
 
         Returns:
-            bool: True if conversion is successful, False otherwise.
+            str: Path to the .png file in the output directory.
         """
         png_filename: str = f"{os.path.splitext(os.path.basename(file_path))[0]}.png"
-        png_path: str = os.path.join(self.output_directory, png_filename)
+        return os.path.join(self.output_directory, png_filename)
+
+    def convert(self, file_path: str, data: Optional[FileData] = None) -> bool:
+        """
+        Convert a .jpg file to a .png file in the output directory.
+
+        Args:
+            file_path (str): Path to the .jpg file.
+            data (Optional[FileData]): Contents of the .jpg file when already read, e.g. by
+                `prefetch_files`. Retries always read the file again.
+
+        Returns:
+            bool: True if conversion is successful, False otherwise.
+        """
+        return self.convert_pair(file_path, self.output_path(file_path), data)
+
+    def convert_pair(
+        self, file_path: str, png_path: str, data: Optional[FileData] = None
+    ) -> bool:
+        """
+        Convert a .jpg file to a given .png file.
+
+        Use this over `convert` when the output paths of many files are computed up front.
+
+        Args:
+            file_path (str): Path to the .jpg file.
+            png_path (str): Path to the .png file to write.
+            data (Optional[FileData]): Contents of the .jpg file when already read, e.g. by
+                `prefetch_files`. Retries always read the file again.
+
+        Returns:
+            bool: True if conversion is successful, False otherwise.
+        """
         attempt: int = 0
 
         if self.dry_run:
-            logger.info(msg=f"Dry run: would convert {file_path} to {png_path}")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Dry run: would convert %s to %s", file_path, png_path)
             return True
 
         while attempt < self.retries:
             try:
                 start_time: float = time.time()
-                with Image.open(file_path) as img:
-                    if self.improve:
-                        img = self.improve_image(img)
-                    if self.upscale > 1:
-                        img = self.upscale_image(img, self.upscale)
-                    img.save(
-                        png_path, "PNG", compress_level=self.compression_level
-                    )
+                self._convert_fn(file_path, png_path, data)
                 end_time: float = time.time()
-                logger.info(
-                    msg=f"Converted {file_path} to {png_path} in {end_time - start_time:.2f} seconds"
-                )
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info(
+                        "Converted %s to %s in %.2f seconds",
+                        file_path,
+                        png_path,
+                        end_time - start_time,
+                    )
                 return True
-            except (IOError, OSError) as e:
+            except (UnidentifiedImageError, struct.error) as e:
+                # The file itself is not a decodable image; reading it again won't help.
                 attempt += 1
-                logger.error(
-                    msg=f"Attempt {attempt} failed to convert {file_path}: {e}"
+                # Pillow names the in-memory buffer of prefetched files rather than the file.
+                reason: str = (
+                    "unrecognized image format"
+                    if isinstance(e, UnidentifiedImageError)
+                    else str(e)
                 )
-                time.sleep(self.retry_delay)
+                logger.error("Cannot decode %s, not retrying: %s", file_path, reason)
+                break
+            except (IOError, OSError) as e:
+                attempt += 1
+                data = None
+                logger.error("Attempt %d failed to convert %s: %s", attempt, file_path, e)
+                if e.errno not in _TRANSIENT_ERRNOS:
+                    break
+                if attempt < self.retries:
+                    # Exponential backoff, jittered so workers don't retry in lockstep.
+                    time.sleep(
+                        self.retry_delay * 2 ** (attempt - 1) + random.uniform(0, 0.1)
+                    )
             except Exception as e:
-                logger.error(msg=f"Non-recoverable error occurred: {e}")
+                attempt += 1
+                logger.error("Non-recoverable error occurred: %s", e)
                 break
 
-        logger.error(
-            msg=f"Failed to convert {file_path} after {self.retries} attempts"
-        )
+        logger.error("Failed to convert %s after %d attempts", file_path, attempt)
         return False
 
+    def _transcode(
+        self, file_path: str, png_path: str, data: Optional[FileData] = None
+    ) -> None:
+        """
+        Re-encode a .jpg file as a .png file without any processing.
+
+        Pillow only decodes the pixels when saving, straight into the PNG encoder,
+        without going through a separate pixel buffer.
+
+        Args:
+            file_path (str): Path to the .jpg file.
+            png_path (str): Path to the .png file to write.
+            data (Optional[FileData]): Contents of the .jpg file, read from `file_path` when None.
+
+        Returns:
+            None
+        """
+        with Image.open(_open_source(file_path, data)) as img:
+            if img.mode not in _PNG_NATIVE_MODES:
+                # PNG cannot store CMYK; normalize everything else to RGB.
+                img = img.convert("RGB")
+            self._save_png(img, png_path)
+
+    def _convert_pixels(
+        self, file_path: str, png_path: str, data: Optional[FileData] = None
+    ) -> None:
+        """
+        Decode, process and encode a .jpg file as a .png file.
+
+        Args:
+            file_path (str): Path to the .jpg file.
+            png_path (str): Path to the .png file to write.
+            data (Optional[FileData]): Contents of the .jpg file, read from `file_path` when None.
+
+        Returns:
+            None
+        """
+        self._encode(self._process(self._decode(file_path, data)), png_path)
+
+    def _decode(self, file_path: str, data: Optional[FileData] = None) -> np.ndarray:
+        """
+        Decode a .jpg file into a pixel buffer.
+
+        Args:
+            file_path (str): Path to the .jpg file.
+            data (Optional[FileData]): Contents of the .jpg file, read from `file_path` when None.
+
+        Returns:
+            np.ndarray: uint8 pixel buffer, (height, width) for grayscale images and
+            (height, width, 3) otherwise.
+        """
+        if _TURBOJPEG is not None:
+            if data is None:
+                data = read_file(file_path)
+            try:
+                with warnings.catch_warnings():
+                    # libjpeg-turbo reports corrupt or truncated data as a warning and
+                    # returns a partly decoded image; treat it as a failed decode.
+                    warnings.simplefilter("error")
+                    arr: Optional[np.ndarray] = self._decode_turbojpeg(data)
+            except (OSError, Warning):
+                # Not a JPEG libturbojpeg can read; let Pillow identify it and report errors.
+                arr = None
+            if arr is not None:
+                return arr
+        with Image.open(_open_source(file_path, data)) as img:
+            if img.mode not in _PNG_NATIVE_MODES:
+                # PNG cannot store CMYK; normalize everything else to RGB.
+                img = img.convert("RGB")
+            return np.asarray(img)
+
+    def _decode_turbojpeg(self, data: FileData) -> Optional[np.ndarray]:
+        """
+        Decode .jpg file contents into a pixel buffer with libturbojpeg.
+
+        libturbojpeg decodes straight into a NumPy array, without an intermediate
+        PIL image to copy the pixels out of.
+
+        Args:
+            data (FileData): Contents of the .jpg file.
+
+        Returns:
+            Optional[np.ndarray]: uint8 pixel buffer, or None for CMYK images, which
+            are left to Pillow to convert to RGB.
+        """
+        colorspace: int = _TURBOJPEG.decode_header(data)[3]
+        if colorspace in (TJCS_CMYK, TJCS_YCCK):
+            return None
+        if colorspace == TJCS_GRAY:
+            return _TURBOJPEG.decode(data, pixel_format=TJPF_GRAY)[:, :, 0]
+        return _TURBOJPEG.decode(data, pixel_format=TJPF_RGB)
+
+    def _process(self, arr: np.ndarray) -> np.ndarray:
+        """
+        Upscale and improve a pixel buffer, according to the converter options.
+
+        The image is upscaled first so that the improvement runs once on the
+        output-sized buffer, and no intermediate PIL images are created.
+
+        Args:
+            arr (np.ndarray): Decoded pixel buffer.
+
+        Returns:
+            np.ndarray: Processed pixel buffer.
+        """
+        for stage in self._stages:
+            arr = stage(arr)
+        return arr
+
+    def _encode(self, arr: np.ndarray, png_path: str) -> None:
+        """
+        Encode a pixel buffer as a .png file.
+
+        Args:
+            arr (np.ndarray): Pixel buffer to encode.
+            png_path (str): Path to the .png file to write.
+
+        Returns:
+            None
+        """
+        arr = np.ascontiguousarray(arr)
+        # Pillow wraps "L" buffers in place; RGB pixels are copied into its
+        # 4-bytes-per-pixel image storage.
+        img: Image.Image = Image.fromarray(arr, _pixel_mode(arr))
+        self._save_png(img, png_path)
+
+    def _save_png(self, img: Image.Image, png_path: str) -> None:
+        """
+        Save an image as a .png file into a pre-sized output file.
+
+        Args:
+            img (Image.Image): Image to save.
+            png_path (str): Path to the .png file to write.
+
+        Returns:
+            None
+        """
+        width: int
+        height: int
+        width, height = img.size
+        raw_bytes: int = width * height * len(img.getbands())
+        fd: int = _pre_size_output(png_path, raw_bytes // _PNG_SIZE_RATIO)
+        try:
+            with open(fd, "wb") as fp:
+                # Explicitly skip Pillow's optimize mode and its extra search for smaller output.
+                img.save(fp, "PNG", compress_level=self.compression_level, optimize=False)
+                # Drop whatever part of the reservation the encoder did not use.
+                fp.truncate()
+        except Exception:
+            # Pillow only removes partial files it opened itself; don't leave a corrupt,
+            # pre-sized .png file behind.
+            try:
+                os.remove(png_path)
+            except OSError:
+                pass
+            raise
+
+    def convert_vips(
+        self, file_path: str, png_path: str, data: Optional[FileData] = None
+    ) -> None:
+        """
+        Convert a .jpg file to a .png file with libvips.
+
+        libvips streams the image in tiles and overlaps JPEG decoding, filtering and
+        PNG encoding on separate threads, without building an intermediate PIL image.
+
+        Args:
+            file_path (str): Path to the .jpg file.
+            png_path (str): Path to the .png file to write.
+            data (Optional[FileData]): Contents of the .jpg file, read from `file_path` when None.
+
+        Returns:
+            None
+        """
+        img: "pyvips.Image" = (
+            pyvips.Image.new_from_file(file_path, access=self._vips_access)
+            if data is None
+            else pyvips.Image.new_from_buffer(data, "", access=self._vips_access)
+        )
+        if img.interpretation not in _VIPS_NATIVE_INTERPRETATIONS:
+            # Like the PIL backend, turn CMYK and other color spaces into RGB.
+            img = img.colourspace("srgb")
+        for stage in self._stages:
+            img = stage(img)
+        img.pngsave(
+            png_path, compression=self.compression_level, filter=self._vips_png_filter
+        )
+
+    def upscale_vips_image(self, img: "pyvips.Image", factor: int) -> "pyvips.Image":
+        """
+        Upscale a libvips image by a given factor.
+
+        Args:
+            img (pyvips.Image): Image to upscale.
+            factor (int): Factor by which to upscale the image.
+
+        Returns:
+            pyvips.Image: Upscaled image.
+        """
+        return img.resize(factor, kernel="lanczos3")
+
+    def improve_vips_image(self, img: "pyvips.Image") -> "pyvips.Image":
+        """
+        Improve the quality of a libvips image, mirroring `improve_image`.
+
+        Args:
+            img (pyvips.Image): Grayscale or RGB image to improve.
+
+        Returns:
+            pyvips.Image: Improved image.
+        """
+        stats: "pyvips.Image" = img.stats()
+        band_means: list[float] = [stats(4, band + 1)[0] for band in range(img.bands)]
+        gray_mean: float = (
+            float(np.dot(band_means, LUMA_WEIGHTS)) if img.bands == 3 else band_means[0]
+        )
+        mean: int = int(gray_mean + 0.5)
+        mask: "pyvips.Image" = pyvips.Image.new_from_array(
+            SHARPEN_KERNEL.tolist(), scale=SHARPEN_DIVISOR
+        )
+        img = img.conv(mask, precision="integer")
+        return img.linear(
+            _CONTRAST_FACTOR, mean * (1 - _CONTRAST_FACTOR), uchar=True
+        )
+
     def improve_image(self, img: Image.Image) -> Image.Image:
         """
         Improve the quality of the image.
@@ -92,10 +541,12 @@ class Converter:
         Returns:
             Image.Image: Improved image.
         """
+        if img.mode in _FUSED_ENHANCE_MODES:
+            return Image.fromarray(enhance(np.asarray(img), _CONTRAST_FACTOR), img.mode)
         sharpness_enhancer: ImageEnhance.Sharpness = ImageEnhance.Sharpness(img)
         img: Image.Image = sharpness_enhancer.enhance(2.0)  # Sharpen the image
         contrast_enhancer: ImageEnhance.Contrast = ImageEnhance.Contrast(img)
-        img = contrast_enhancer.enhance(1.5)  # Enhance contrast
+        img = contrast_enhancer.enhance(_CONTRAST_FACTOR)  # Enhance contrast
         return img
 
     def upscale_image(self, img: Image.Image, factor: int) -> Image.Image:
@@ -109,8 +560,39 @@ class Converter:
         Returns:
             Image.Image: Upscaled image.
         """
+        if img.mode in _PIXEL_MODES.values():
+            return Image.fromarray(self.upscale_pixels(np.asarray(img), factor), img.mode)
         width: int
         height: int
         width, height = img.size
         new_size: tuple[int, int] = (width * factor, height * factor)
-        return img.resize(new_size, Image.LANCZOS)
+        return img.resize(new_size, Image.LANCZOS, reducing_gap=self.reducing_gap)
+
+    def upscale_pixels(self, arr: np.ndarray, factor: int) -> np.ndarray:
+        """
+        Upscale a pixel buffer by a given factor.
+
+        Args:
+            arr (np.ndarray): uint8 pixel buffer with 1, 3 or 4 channels.
+            factor (int): Factor by which to upscale the buffer.
+
+        Returns:
+            np.ndarray: Upscaled pixel buffer.
+        """
+        height: int
+        width: int
+        height, width = arr.shape[:2]
+        new_size: tuple[int, int] = (width * factor, height * factor)
+        mode: str = _pixel_mode(arr)
+        if _RESIZER is not None:
+            pixel_type: "PixelType" = _SIMD_PIXEL_TYPES[mode]
+            src: ImageData = ImageData(width, height, pixel_type, arr.tobytes())
+            dst: ImageData = ImageData(new_size[0], new_size[1], pixel_type)
+            _RESIZER.resize(src, dst, _RESIZE_OPTIONS)
+            return np.frombuffer(dst.get_buffer(), dtype=np.uint8).reshape(
+                (new_size[1], new_size[0]) + arr.shape[2:]
+            )
+        img: Image.Image = Image.fromarray(arr, mode)
+        return np.asarray(
+            img.resize(new_size, Image.LANCZOS, reducing_gap=self.reducing_gap)
+        )
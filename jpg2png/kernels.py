@@ -0,0 +1,171 @@
+"""
+Module with fused pixel kernels used to improve image quality.
+
+Functions:
+    enhance: Sharpen and adjust the contrast of a pixel buffer in a single pass.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# ITU-R 601-2 luma weights, as used by Pillow's "L" conversion.
+LUMA_WEIGHTS: np.ndarray = np.array([0.299, 0.587, 0.114])
+
+# Sharpening kernel equivalent to `ImageEnhance.Sharpness(2.0)`, i.e. 2 * img - smooth
+# with Pillow's SMOOTH filter [[1, 1, 1], [1, 5, 1], [1, 1, 1]] / 13, scaled by
+# SHARPEN_DIVISOR so that all taps and intermediate sums fit in int16.
+SHARPEN_KERNEL: np.ndarray = np.array(
+    [[-1, -1, -1], [-1, 21, -1], [-1, -1, -1]], dtype=np.int16
+)
+SHARPEN_DIVISOR: int = 13
+
+# Range of the unscaled sharpening sums over uint8 pixels.
+_SHARPEN_MIN: int = 255 * int(SHARPEN_KERNEL[SHARPEN_KERNEL < 0].sum())
+_SHARPEN_MAX: int = 255 * int(SHARPEN_KERNEL[SHARPEN_KERNEL > 0].sum())
+
+# Contrast factors are applied in Q8 fixed point.
+CONTRAST_SHIFT: int = 8
+
+
+def _contrast_lut(contrast: float, mean: int) -> np.ndarray:
+    """
+    Build the lookup table mapping each gray level to its contrast-adjusted value.
+
+    Only 256 input values exist, so the affine contrast transform is evaluated once
+    per level, in integer fixed point, instead of once per pixel.
+
+    Args:
+        contrast (float): Contrast factor applied around `mean`.
+        mean (int): Gray level the contrast is scaled around.
+
+    Returns:
+        np.ndarray: uint8 lookup table of 256 entries.
+    """
+    factor: int = round(contrast * (1 << CONTRAST_SHIFT))
+    levels: np.ndarray = np.arange(256, dtype=np.int32) - mean
+    rounding: int = 1 << (CONTRAST_SHIFT - 1)
+    lut: np.ndarray = mean + ((factor * levels + rounding) >> CONTRAST_SHIFT)
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+
+def _enhance_lut(contrast: float, mean: int) -> np.ndarray:
+    """
+    Build the lookup table mapping each unscaled sharpening sum to its output value.
+
+    The table folds in the division by `SHARPEN_DIVISOR`, the clipping of the
+    sharpened pixel to uint8 and the contrast adjustment; it is indexed with
+    `sum - _SHARPEN_MIN`.
+
+    Args:
+        contrast (float): Contrast factor applied around `mean`.
+        mean (int): Gray level the contrast is scaled around.
+
+    Returns:
+        np.ndarray: uint8 lookup table of `_SHARPEN_MAX - _SHARPEN_MIN + 1` entries.
+    """
+    sums: np.ndarray = np.arange(_SHARPEN_MIN, _SHARPEN_MAX + 1, dtype=np.int32)
+    sharpened: np.ndarray = np.clip(
+        (sums + SHARPEN_DIVISOR // 2) // SHARPEN_DIVISOR, 0, 255
+    )
+    return _contrast_lut(contrast, mean)[sharpened]
+
+
+def _fuse_numpy(arr: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """
+    Vectorized NumPy fallback of the fused sharpen + contrast kernel.
+
+    Args:
+        arr (np.ndarray): Pixel buffer of shape (height, width, channels).
+        lut (np.ndarray): Lookup table built by `_enhance_lut`.
+
+    Returns:
+        np.ndarray: Enhanced uint8 pixel buffer with the same shape as `arr`.
+    """
+    height, width = arr.shape[:2]
+    # Like Pillow's filters, leave the one pixel wide border unsharpened.
+    sums: np.ndarray = arr.astype(np.int16) * SHARPEN_DIVISOR
+    if height > 2 and width > 2:
+        inner: np.ndarray = np.zeros((height - 2, width - 2, arr.shape[2]), dtype=np.int16)
+        for dy, dx in zip(*np.nonzero(SHARPEN_KERNEL)):
+            inner += SHARPEN_KERNEL[dy, dx] * arr[
+                dy : dy + height - 2, dx : dx + width - 2
+            ].astype(np.int16)
+        sums[1:-1, 1:-1] = inner
+    sums -= _SHARPEN_MIN
+    return lut[sums]
+
+
+def _fuse_loops(arr: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """
+    Fused sharpen + contrast kernel, compiled with Numba and run in parallel over rows.
+
+    Args:
+        arr (np.ndarray): Pixel buffer of shape (height, width, channels).
+        lut (np.ndarray): Lookup table built by `_enhance_lut`.
+
+    Returns:
+        np.ndarray: Enhanced uint8 pixel buffer with the same shape as `arr`.
+    """
+    height, width, channels = arr.shape
+    out = np.empty_like(arr)
+    for y in prange(height):
+        for x in range(width):
+            if 0 < y < height - 1 and 0 < x < width - 1:
+                for c in range(channels):
+                    acc = np.int16(0)
+                    for ky in range(3):
+                        for kx in range(3):
+                            acc += SHARPEN_KERNEL[ky, kx] * np.int16(
+                                arr[y + ky - 1, x + kx - 1, c]
+                            )
+                    out[y, x, c] = lut[acc - _SHARPEN_MIN]
+            else:
+                # Like Pillow's filters, leave the one pixel wide border unsharpened.
+                for c in range(channels):
+                    acc = np.int16(arr[y, x, c]) * SHARPEN_DIVISOR
+                    out[y, x, c] = lut[acc - _SHARPEN_MIN]
+    return out
+
+
+if njit is not None:
+    _fuse = njit(parallel=True, cache=True)(_fuse_loops)
+    # Compile eagerly so the first converted image does not pay the JIT cost. Decoded
+    # and upscaled buffers are often read-only views, which Numba compiles separately.
+    _warm: np.ndarray = np.zeros((3, 3, 3), dtype=np.uint8)
+    _fuse(_warm, _enhance_lut(1.0, 0))
+    _warm.setflags(write=False)
+    _fuse(_warm, _enhance_lut(1.0, 0))
+    del _warm
+else:
+    _fuse = _fuse_numpy
+
+
+def enhance(arr: np.ndarray, contrast: float) -> np.ndarray:
+    """
+    Sharpen and adjust the contrast of a pixel buffer in a single pass.
+
+    Pixels are sharpened with `SHARPEN_KERNEL`, then the contrast is scaled around the
+    mean gray level of the input, following `PIL.ImageEnhance.Contrast` semantics.
+    The per-pixel math is integer-only: an int16 convolution followed by a uint8
+    lookup table that scales, clips and adjusts the contrast of the sums.
+
+    Args:
+        arr (np.ndarray): uint8 pixel buffer of shape (height, width) or (height, width, channels).
+        contrast (float): Contrast factor.
+
+    Returns:
+        np.ndarray: Enhanced uint8 pixel buffer with the same shape as `arr`.
+    """
+    pixels: np.ndarray = np.ascontiguousarray(arr).reshape(arr.shape[0], arr.shape[1], -1)
+    channel_means: np.ndarray = pixels.mean(axis=(0, 1))
+    gray_mean: float = (
+        float(channel_means @ LUMA_WEIGHTS)
+        if pixels.shape[2] == 3
+        else float(channel_means[0])
+    )
+    out: np.ndarray = _fuse(pixels, _enhance_lut(contrast, int(gray_mean + 0.5)))
+    return out.reshape(arr.shape)
@@ -1,11 +1,20 @@
 import os
 import logging
+import mmap
 import signal
 import sys
-from typing import Any, Generator
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Generator, Iterable, Optional, Tuple, Union
 
 logger: logging.Logger = logging.getLogger("jpg2png.utils")
 
+# Contents of a prefetched file: small files are read into memory, large ones are mapped.
+FileData = Union[bytes, mmap.mmap]
+
+# Files at least this large are memory-mapped instead of copied into memory.
+MMAP_THRESHOLD: int = 64 * 1024 * 1024
+
 
 def configure_logging(log_level: str = "INFO", log_file: str = "error_log.txt") -> None:
     """
@@ -37,17 +46,103 @@ def file_generator(
     """
     Generate file paths with the given extension in the specified directory.
 
+    The directory tree is walked with `os.scandir`, whose entries carry the file
+    type read from the directory itself, so no extra `stat` call is needed per
+    entry. Symbolic links to directories are not followed, as with `os.walk`.
+
     Args:
         directory (str): Path to the directory.
-        extension (str): File extension to filter by.
+        extension (str): File extension to filter by, matched case-insensitively.
 
     Yields:
         str: Full path to each file with the given extension.
     """
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith(extension):
-                yield os.path.join(root, file)
+    extension = extension.lower()
+    stack: list[str] = [directory]
+    while stack:
+        path: str = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(extension) and entry.is_file():
+                        yield entry.path
+        except OSError as e:
+            logger.warning("Skipping directory '%s': %s", path, e)
+
+
+def read_file(file_path: str) -> FileData:
+    """
+    Read the contents of a file, memory-mapping it when it is large.
+
+    Mapped files are advised as needed soon, so the kernel starts reading them in
+    the background instead of faulting pages in during decoding.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        FileData: The file contents, as bytes or as a read-only memory map.
+    """
+    with open(file_path, "rb") as f:
+        size: int = os.fstat(f.fileno()).st_size
+        if size < MMAP_THRESHOLD:
+            return f.read()
+        data: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_WILLNEED"):
+        data.madvise(mmap.MADV_WILLNEED)
+    return data
+
+
+def prefetch_files(
+    file_paths: Iterable[str], depth: int = 2
+) -> Generator[Tuple[str, Optional[FileData]], None, None]:
+    """
+    Read files ahead of their consumer in background threads.
+
+    Reading is IO-bound while decoding is CPU-bound, so up to `depth` files are read
+    in the background while the caller processes the current one. Reads are only
+    started as the caller advances, which bounds the memory held by prefetched files.
+
+    Args:
+        file_paths (Iterable[str]): Paths of the files to read, in consumption order.
+        depth (int): Maximum number of files read ahead. Defaults to 2.
+
+    Yields:
+        Tuple[str, Optional[FileData]]: Each path with its contents, or None when the
+        file could not be read, leaving the caller to read (and report on) it itself.
+    """
+    paths = iter(file_paths)
+    with ThreadPoolExecutor(max_workers=depth) as reader:
+        pending: Deque[Tuple[str, Future]] = deque(
+            (path, reader.submit(read_file, path)) for _, path in zip(range(depth), paths)
+        )
+        while pending:
+            path, future = pending.popleft()
+            next_path: Optional[str] = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, reader.submit(read_file, next_path)))
+            try:
+                data: Optional[FileData] = future.result()
+            except OSError:
+                data = None
+            yield path, data
+
+
+def available_cpu_count() -> int:
+    """
+    Get the number of CPUs the current process is allowed to run on.
+
+    Honors the CPU affinity mask (e.g. taskset, cgroup cpusets) where the platform
+    exposes it, and falls back to the total number of CPUs otherwise.
+
+    Returns:
+        int: Number of usable CPUs, at least 1.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
 
 
 def handle_signal(signal: int, frame: Any) -> None:
@@ -3,10 +3,12 @@ import os
 import signal
 import sys
 import logging
-import threading
+import mmap
+import multiprocessing
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed, Future
-from queue import Queue
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List, Optional, Tuple
 from tqdm import tqdm
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
@@ -15,31 +17,59 @@ from jpg2png import (
     file_generator,
     configure_logging,
     handle_signal,
+    available_cpu_count,
+    prefetch_files,
 )
 from jpg2png.config import parse_arguments
+from jpg2png.utils import FileData
 
-def dynamic_thread_adjustment(
-    executor: ThreadPoolExecutor, queue: Queue, shutdown_event: threading.Event, threshold: int = 10
-) -> None:
+# Converter shared by all tasks of a worker process, set up by `init_worker`.
+_converter: Optional[Converter] = None
+
+
+def init_worker(converter: Converter) -> None:
     """
-    Adjust the number of threads dynamically based on the system load.
+    Initialize a worker process with the converter used for all of its tasks.
 
     Args:
-        executor (ThreadPoolExecutor): Thread pool executor to adjust.
-        queue (Queue): Queue to monitor for task count.
-        shutdown_event (threading.Event): Event to signal shutdown.
-        threshold (int): Threshold for adjusting the number of threads.
+        converter (Converter): Converter configured for this run.
+    """
+    global _converter
+    _converter = converter
+
+
+def convert_files(work: List[Tuple[str, str]]) -> List[bool]:
     """
-    while not shutdown_event.is_set():
-        time.sleep(5)
-        queue_size = queue.qsize()
-        cpu_count: int = os.cpu_count() or 1
-        if queue_size > threshold and executor._max_workers < cpu_count:
-            executor._max_workers += 1
-            logging.info(msg=f"Increased number of threads to: {executor._max_workers}")
-        elif queue_size < threshold and executor._max_workers > 1:
-            executor._max_workers -= 1
-            logging.info(msg=f"Decreased number of threads to: {executor._max_workers}")
+    Convert a chunk of files in a worker process.
+
+    The next files of the chunk are read from disk in background threads while the
+    current one is being decoded and encoded, hiding disk latency behind the CPU work.
+
+    Args:
+        work (List[Tuple[str, str]]): Paths to the .jpg files and to their .png files.
+
+    Returns:
+        List[bool]: For each file, True if conversion is successful, False otherwise.
+    """
+    results: List[bool] = []
+    # A dry run never reads the files, so there is nothing to prefetch.
+    prefetched: Iterator[Tuple[str, Optional[FileData]]] = (
+        ((file_path, None) for file_path, _ in work)
+        if _converter.dry_run
+        else prefetch_files(file_path for file_path, _ in work)
+    )
+    for (file_path, data), (_, png_path) in zip(prefetched, work):
+        try:
+            results.append(_converter.convert_pair(file_path, png_path, data))
+        except Exception as e:
+            # Keep a single failure from aborting the rest of the chunk.
+            logging.error("An error occurred: %s", e)
+            results.append(False)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+    return results
+
 
 def main() -> None:
     args: Namespace = parse_arguments()
@@ -47,24 +77,26 @@ def main() -> None:
 
     if not os.path.isdir(args.directory):
         logging.error(
-            msg=f"The specified path '{args.directory}' is not a directory or does not exist."
+            "The specified path '%s' is not a directory or does not exist.",
+            args.directory,
         )
         sys.exit(1)
 
     output_directory: str = args.output or args.directory
     if not os.path.isdir(output_directory):
         os.makedirs(output_directory, exist_ok=True)
-        logging.info(msg=f"Created output directory '{output_directory}'")
+        logging.info("Created output directory '%s'", output_directory)
 
     jpg_files: list[str] = list(file_generator(args.directory, ".jpg"))
     if not jpg_files:
-        logging.error(msg="No .jpg files found in the specified directory.")
+        logging.error("No .jpg files found in the specified directory.")
         sys.exit(0)
 
-    num_threads: int = (
-        args.threads if isinstance(args.threads, int) else os.cpu_count() or 1
-    )
-    logging.info(msg=f"Using {num_threads} threads for conversion.")
+    # The pool is sized once: libjpeg/libpng are single-threaded per image, and
+    # running more workers than usable CPUs only adds contention.
+    cpu_count: int = available_cpu_count()
+    num_threads: int = min(args.threads or cpu_count, cpu_count)
+    logging.info("Using %d worker processes for conversion.", num_threads)
 
     converter: Converter = Converter(
         output_directory,
@@ -73,47 +105,67 @@ def main() -> None:
         args.retry_delay,
         args.dry_run,
         args.improve,
-        args.upscale
+        args.upscale,
+        args.reducing_gap,
+        args.backend,
     )
 
-    # Register signal handlers for clean shutdown
-    shutdown_event: threading.Event = threading.Event()
-    signal.signal(signal.SIGINT, lambda s, f: shutdown_event.set())
-    signal.signal(signal.SIGTERM, lambda s, f: shutdown_event.set())
+    # Processes split the files, numba/libvips threads split each image: give every
+    # worker its share of the CPUs rather than one thread per CPU each. Spawned
+    # workers inherit the environment and numba/libvips read it on import.
+    threads_per_worker: str = str(max(1, cpu_count // num_threads))
+    os.environ.setdefault("NUMBA_NUM_THREADS", threads_per_worker)
+    if converter.backend == "vips":
+        os.environ.setdefault("VIPS_CONCURRENCY", threads_per_worker)
+
+    # Output paths are computed once here rather than per file in the workers
+    work: List[Tuple[str, str]] = [
+        (file, converter.output_path(file)) for file in jpg_files
+    ]
+
+    # Register signal handler for clean shutdown
+    signal.signal(signal.SIGTERM, handle_signal)
 
     start_time: float = time.time()
     success_count: int = 0
     failure_count: int = 0
-    task_queue: Queue = Queue()
 
     try:
-        with ThreadPoolExecutor(max_workers=num_threads) as executor:
-            threading.Thread(
-                target=dynamic_thread_adjustment,
-                args=(executor, task_queue, shutdown_event),
-                daemon=True,
-            ).start()
-
-            futures: dict[Future[bool], str] = {executor.submit(converter.convert, file): file for file in jpg_files}
-            for future in tqdm(as_completed(futures), total=len(jpg_files), desc="Converting", unit="file"):
+        # Spawn rather than fork, so that every worker imports numba and libvips
+        # afresh and sizes their thread pools from the environment set above.
+        with ProcessPoolExecutor(
+            max_workers=num_threads,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(converter,),
+        ) as executor:
+            # Hand out work in chunks to amortize inter-process scheduling overhead;
+            # each worker prefetches the files of its chunk while converting them.
+            chunksize: int = max(1, len(work) // (num_threads * 4))
+            chunks: List[List[Tuple[str, str]]] = [
+                work[i : i + chunksize] for i in range(0, len(work), chunksize)
+            ]
+            results: Iterator[List[bool]] = executor.map(convert_files, chunks)
+            with tqdm(total=len(jpg_files), desc="Converting", unit="file") as progress:
                 try:
-                    result: bool = future.result()
-                    task_queue.put(result)
-                    if result:
-                        success_count += 1
-                    else:
-                        failure_count += 1
-                except Exception as e:
-                    logging.error(msg=f"An error occurred: {e}")
-                    failure_count += 1
+                    for chunk_results in results:
+                        converted: int = sum(chunk_results)
+                        success_count += converted
+                        failure_count += len(chunk_results) - converted
+                        progress.update(len(chunk_results))
+                except BrokenProcessPool as e:
+                    # A worker died, e.g. killed for running out of memory, and took the
+                    # pool down with it: the files without a result count as failures.
+                    logging.error("A worker process terminated abruptly: %s", e)
+                    failure_count = len(work) - success_count
     except KeyboardInterrupt:
         logging.warning("Conversion process interrupted by user.")
         sys.exit(1)
 
     total_time: float = time.time() - start_time
-    logging.info(msg=f"Conversion completed in {total_time:.2f} seconds")
-    logging.info(msg=f"Successfully converted {success_count} files")
-    logging.info(msg=f"Failed to convert {failure_count} files")
+    logging.info("Conversion completed in %.2f seconds", total_time)
+    logging.info("Successfully converted %d files", success_count)
+    logging.info("Failed to convert %d files", failure_count)
 
 
 if __name__ == "__main__":
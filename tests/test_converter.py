@@ -1,13 +1,18 @@
 import unittest
 from unittest.mock import patch, MagicMock
+import errno
 import os
 import tempfile
 import sys
+import warnings
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import numpy as np
+from PIL import Image
+
 from jpg2png.converter import Converter
-from jpg2png.utils import file_generator
+from jpg2png.utils import available_cpu_count, file_generator, prefetch_files
 
 
 class TestJpgToPngConverter(unittest.TestCase):
@@ -80,31 +85,158 @@ class TestJpgToPngConverter(unittest.TestCase):
         self.assertEqual(len(files), 1)
         self.assertEqual(files[0], self.test_file)
 
-    @patch("jpg2png.converter.Image.open")
-    def test_convert_jpg_to_png(self, mock_open: MagicMock) -> None:
+    def test_file_generator_recursive(self) -> None:
+        """
+        Test the `file_generator` function on a nested directory tree.
+
+        This test case adds a subdirectory holding an upper-case ".JPG" file and a ".png" file,
+        and asserts that both JPG files are found while the PNG file is ignored.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        sub_dir: str = os.path.join(self.test_dir.name, "nested", "deeper")
+        os.makedirs(sub_dir)
+        nested_file: str = os.path.join(sub_dir, "NESTED.JPG")
+        for path in (nested_file, os.path.join(sub_dir, "other.png")):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("fake content")
+
+        files: list[str] = sorted(file_generator(self.test_dir.name, ".jpg"))
+        self.assertEqual(files, sorted([self.test_file, nested_file]))
+
+    def test_prefetch_files(self) -> None:
+        """
+        Test the `prefetch_files` function.
+
+        This test case prefetches the test file, a missing file and the test file again with
+        memory-mapping forced on, and checks that the files are yielded in order, that the
+        missing file yields None, and that the mapped contents match the file.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        missing_file: str = os.path.join(self.test_dir.name, "missing.jpg")
+        results = list(prefetch_files([self.test_file, missing_file]))
+        self.assertEqual(results, [(self.test_file, b"fake jpg content"), (missing_file, None)])
+
+        with patch("jpg2png.utils.MMAP_THRESHOLD", 0):
+            ((path, data),) = prefetch_files([self.test_file])
+        self.assertEqual(path, self.test_file)
+        self.assertEqual(data[:], b"fake jpg content")
+        data.close()
+
+    def test_convert_jpg_to_png(self) -> None:
         """
         Test the `convert` method of the `Converter` class to ensure it correctly converts a JPG image to PNG.
 
-        This test case mocks the `Image.open` method to simulate the opening of a JPG image file.
+        This test case overwrites the test file with a real JPG image.
         It then creates an instance of the `Converter` class with the specified directory and `dry_run` set to `False`.
-        The `convert` method is called with the test file path, and the result is checked to ensure it is `True`.
-        Finally, it asserts that the `save` method of the mocked image object is called once.
+        The `convert` method is called with the test file path, and the result is checked to ensure it is `True`
+        and that, with neither improvement nor upscaling, no intermediate pixel buffer was decoded.
+        Finally, it asserts that the PNG image was written next to it with the same mode and size,
+        and that the file ends with the IEND chunk, i.e. no pre-allocated space was left behind.
 
         Parameters:
             self (TestJpgToPngConverter): The instance of the test class.
-            mock_open (MagicMock): The mocked `Image.open` method.
 
         Returns:
             None
         """
-        mock_image: MagicMock = MagicMock()
-        mock_open.return_value.__enter__.return_value = mock_image
+        Image.new("RGB", (16, 8), (10, 120, 230)).save(self.test_file, "JPEG")
 
         converter: Converter = Converter(self.test_dir.name, dry_run=False)
+        with patch.object(Converter, "_decode") as mock_decode:
+            result: bool = converter.convert(self.test_file)
+
+        self.assertTrue(result)
+        mock_decode.assert_not_called()
+        with Image.open(os.path.join(self.test_dir.name, "test.png")) as png:
+            self.assertEqual(png.format, "PNG")
+            self.assertEqual(png.mode, "RGB")
+            self.assertEqual(png.size, (16, 8))
+        with open(os.path.join(self.test_dir.name, "test.png"), "rb") as f:
+            self.assertTrue(f.read().endswith(b"IEND\xaeB`\x82"))
+
+    def test_failed_conversion_leaves_no_output(self) -> None:
+        """
+        Test that a failed conversion does not leave a partial PNG file behind.
+
+        This test case truncates a real JPG image in the middle of its pixel data, so that decoding
+        only fails while the PNG file is being written, and converts it both directly and with
+        improvement enabled. Both conversions must fail and leave no PNG file in the output directory.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        Image.effect_noise((64, 64), 50).convert("RGB").save(self.test_file, "JPEG")
+        with open(self.test_file, "rb") as f:
+            data: bytes = f.read()
+        with open(self.test_file, "wb") as f:
+            f.write(data[: len(data) // 2])
+
+        png_path: str = os.path.join(self.test_dir.name, "test.png")
+        for improve in (False, True):
+            converter: Converter = Converter(self.test_dir.name, retries=1, improve=improve)
+            self.assertFalse(converter.convert(self.test_file))
+            self.assertFalse(os.path.exists(png_path))
+
+    def test_convert_with_improve_and_upscale(self) -> None:
+        """
+        Test the `convert` method of the `Converter` class with improvement and upscaling enabled.
+
+        This test case converts a real grayscale JPG image with `improve` set to `True` and `upscale`
+        set to 2, and checks that the PNG image keeps the grayscale mode and has twice the size.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        Image.new("L", (16, 8), 90).save(self.test_file, "JPEG")
+
+        converter: Converter = Converter(self.test_dir.name, improve=True, upscale=2)
         result: bool = converter.convert(self.test_file)
 
         self.assertTrue(result)
-        mock_image.save.assert_called_once()
+        with Image.open(os.path.join(self.test_dir.name, "test.png")) as png:
+            self.assertEqual(png.mode, "L")
+            self.assertEqual(png.size, (32, 16))
+
+    def test_convert_pair(self) -> None:
+        """
+        Test the `convert_pair` and `output_path` methods of the `Converter` class.
+
+        This test case checks that `output_path` maps the test file into the output directory,
+        then converts a real JPG image to an explicitly given PNG path with `convert_pair`.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        Image.new("RGB", (16, 8), (10, 120, 230)).save(self.test_file, "JPEG")
+        output_dir: str = os.path.join(self.test_dir.name, "out")
+        os.makedirs(output_dir)
+        converter: Converter = Converter(output_dir)
+        self.assertEqual(
+            converter.output_path(self.test_file), os.path.join(output_dir, "test.png")
+        )
+
+        png_path: str = os.path.join(output_dir, "renamed.png")
+        self.assertTrue(converter.convert_pair(self.test_file, png_path))
+        self.assertTrue(os.path.isfile(png_path))
 
     def test_dry_run(self) -> None:
         """
@@ -124,33 +256,71 @@ class TestJpgToPngConverter(unittest.TestCase):
         result: bool = converter.convert(self.test_file)
         self.assertTrue(result)
 
+    @patch("jpg2png.converter.time.sleep")
     @patch(
         "jpg2png.converter.Image.open",
-        side_effect=OSError("Cannot open file"),
+        side_effect=OSError(errno.EMFILE, "Too many open files"),
     )
-    def test_convert_with_retry(self, mock_open: MagicMock) -> None:
+    def test_convert_with_retry(self, mock_open: MagicMock, mock_sleep: MagicMock) -> None:
         """
         Test the retry mechanism of the `Converter` class.
 
-        This test case mocks the `Image.open` method to simulate the opening of a file that raises an `OSError`.
-        It creates an instance of the `Converter` class with the specified directory, retries set to 2,
+        This test case mocks the `Image.open` method to simulate the opening of a file that raises a transient
+        `OSError` (too many open files).
+        It creates an instance of the `Converter` class with the specified directory, retries set to 3,
         and retry delay set to 1.
         It then calls the `convert` method with the test file path and checks if the result is `False`.
-        Finally, it asserts that the `call_count` of the mocked `Image.open` method is equal to 2.
+        Finally, it asserts that the `call_count` of the mocked `Image.open` method is equal to 3, and that
+        the delay between attempts doubles each time.
 
         Parameters:
             self (TestConverter): The instance of the test class.
+            mock_open (MagicMock): The mocked `Image.open` method.
+            mock_sleep (MagicMock): The mocked `time.sleep` function.
 
         Returns:
             None
         """
         converter: Converter = Converter(
-            self.test_dir.name, retries=2, retry_delay=1
+            self.test_dir.name, retries=3, retry_delay=1
         )
         result: bool = converter.convert(self.test_file)
 
         self.assertFalse(result)
+        self.assertEqual(mock_open.call_count, 3)
+        delays: list[float] = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertGreaterEqual(delays[0], 1)
+        self.assertLess(delays[0], 1.1)
+        self.assertGreaterEqual(delays[1], 2)
+        self.assertLess(delays[1], 2.1)
+
+    @patch("jpg2png.converter.time.sleep")
+    def test_convert_without_retry(self, mock_sleep: MagicMock) -> None:
+        """
+        Test that permanent errors are not retried by the `Converter` class.
+
+        This test case converts the test file, whose content is not a decodable image, and a file that
+        does not exist. Both conversions must fail after a single attempt, without waiting.
+
+        Parameters:
+            self (TestConverter): The instance of the test class.
+            mock_sleep (MagicMock): The mocked `time.sleep` function.
+
+        Returns:
+            None
+        """
+        converter: Converter = Converter(
+            self.test_dir.name, retries=3, retry_delay=1
+        )
+        with patch("jpg2png.converter.Image.open", wraps=Image.open) as mock_open:
+            self.assertFalse(converter.convert(self.test_file))
+            self.assertFalse(
+                converter.convert(os.path.join(self.test_dir.name, "missing.jpg"))
+            )
+
         self.assertEqual(mock_open.call_count, 2)
+        mock_sleep.assert_not_called()
 
     @patch(
         "jpg2png.converter.Image.open",
@@ -181,6 +351,225 @@ class TestJpgToPngConverter(unittest.TestCase):
         self.assertFalse(result)
         self.assertEqual(mock_open.call_count, 1)
 
+    @patch.multiple(
+        "jpg2png.converter",
+        create=True,
+        TJCS_GRAY=2,
+        TJCS_CMYK=3,
+        TJCS_YCCK=4,
+        TJPF_RGB=0,
+        TJPF_GRAY=6,
+    )
+    def test_decode_turbojpeg(self) -> None:
+        """
+        Test the `_decode` method of the `Converter` class with libturbojpeg available.
+
+        This test case replaces libturbojpeg with a fake, and checks that color images are decoded
+        to RGB, that grayscale images are decoded to a single-channel buffer, and that CMYK images
+        are left to Pillow to convert to RGB.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        converter: Converter = Converter(self.test_dir.name)
+        rgb: np.ndarray = np.full((8, 16, 3), 7, dtype=np.uint8)
+        gray: np.ndarray = np.full((8, 16, 1), 9, dtype=np.uint8)
+        with patch("jpg2png.converter._TURBOJPEG") as mock_turbojpeg:
+            mock_turbojpeg.decode_header.return_value = (16, 8, 0, 1)
+            mock_turbojpeg.decode.return_value = rgb
+            self.assertIs(converter._decode(self.test_file, b"jpeg"), rgb)
+            mock_turbojpeg.decode.assert_called_once_with(b"jpeg", pixel_format=0)
+
+            mock_turbojpeg.decode_header.return_value = (16, 8, 0, 2)
+            mock_turbojpeg.decode.return_value = gray
+            result: np.ndarray = converter._decode(self.test_file, b"jpeg")
+            self.assertEqual(result.shape, (8, 16))
+            mock_turbojpeg.decode.assert_called_with(b"jpeg", pixel_format=6)
+
+            Image.new("CMYK", (16, 8), (0, 255, 255, 0)).save(self.test_file, "JPEG")
+            mock_turbojpeg.decode_header.return_value = (16, 8, 0, 3)
+            mock_turbojpeg.decode.reset_mock()
+            result = converter._decode(self.test_file)
+            mock_turbojpeg.decode.assert_not_called()
+            self.assertEqual(result.shape, (8, 16, 3))
+
+    @patch.multiple(
+        "jpg2png.converter",
+        create=True,
+        TJCS_GRAY=2,
+        TJCS_CMYK=3,
+        TJCS_YCCK=4,
+        TJPF_RGB=0,
+        TJPF_GRAY=6,
+    )
+    def test_decode_turbojpeg_corrupt(self) -> None:
+        """
+        Test the `Converter` class when libturbojpeg cannot cleanly decode a file.
+
+        This test case replaces libturbojpeg with a fake. When decoding fails with an error, the
+        file must be decoded by Pillow instead. When decoding only issues a warning, as libjpeg-turbo
+        does for truncated data, the partly decoded image must not be used: the file is handed to
+        Pillow, which fails on it, so that the conversion fails and no PNG file is written.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        Image.new("RGB", (16, 8), (10, 120, 230)).save(self.test_file, "JPEG")
+        converter: Converter = Converter(self.test_dir.name, retries=1, improve=True)
+        with patch("jpg2png.converter._TURBOJPEG") as mock_turbojpeg:
+            mock_turbojpeg.decode_header.return_value = (16, 8, 0, 1)
+            mock_turbojpeg.decode.side_effect = OSError("Unsupported JPEG process")
+            self.assertEqual(converter._decode(self.test_file).shape, (8, 16, 3))
+
+            def decode_partly(data: bytes, pixel_format: int) -> np.ndarray:
+                warnings.warn("Premature end of JPEG file")
+                return np.zeros((8, 16, 3), dtype=np.uint8)
+
+            mock_turbojpeg.decode.side_effect = decode_partly
+            with open(self.test_file, "rb") as f:
+                data: bytes = f.read()
+            with open(self.test_file, "wb") as f:
+                f.write(data[: len(data) // 2])
+            self.assertFalse(converter.convert(self.test_file))
+
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir.name, "test.png")))
+
+    def test_upscale_image(self) -> None:
+        """
+        Test the `upscale_image` method of the `Converter` class.
+
+        This test case upscales a small in-memory RGB image by a factor of 3 and checks
+        that the result keeps the image mode and has the expected dimensions, regardless
+        of whether the SIMD resizer or the Pillow fallback is used.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        img: Image.Image = Image.new("RGB", (4, 3), (200, 100, 50))
+        converter: Converter = Converter(self.test_dir.name)
+        result: Image.Image = converter.upscale_image(img, 3)
+
+        self.assertEqual(result.mode, "RGB")
+        self.assertEqual(result.size, (12, 9))
+        self.assertEqual(result.getpixel((6, 4)), (200, 100, 50))
+
+    def test_improve_image(self) -> None:
+        """
+        Test the `improve_image` method of the `Converter` class.
+
+        This test case improves a flat gray RGB image, which must come back unchanged since it has
+        neither edges to sharpen nor contrast to stretch, and a two-tone grayscale image, whose
+        dark and bright halves must be pushed further apart.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        converter: Converter = Converter(self.test_dir.name)
+
+        flat: Image.Image = Image.new("RGB", (8, 8), (90, 90, 90))
+        result: Image.Image = converter.improve_image(flat)
+        self.assertEqual(result.mode, "RGB")
+        self.assertEqual(result.size, (8, 8))
+        self.assertEqual(result.tobytes(), flat.tobytes())
+
+        two_tone: Image.Image = Image.new("L", (8, 8), 100)
+        two_tone.paste(150, (4, 0, 8, 8))
+        result = converter.improve_image(two_tone)
+        self.assertEqual(result.mode, "L")
+        self.assertLess(result.getpixel((0, 0)), 100)
+        self.assertGreater(result.getpixel((7, 7)), 150)
+
+    @patch("jpg2png.converter.pyvips", None)
+    def test_vips_backend_fallback(self) -> None:
+        """
+        Test the backend selection of the `Converter` class.
+
+        This test case simulates a missing pyvips installation and checks that requesting the
+        "vips" backend falls back to "pil", while an unknown backend raises a `ValueError`.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        converter: Converter = Converter(self.test_dir.name, backend="vips")
+        self.assertEqual(converter.backend, "pil")
+
+        with self.assertRaises(ValueError):
+            Converter(self.test_dir.name, backend="opencv")
+
+    @patch("jpg2png.converter.pyvips")
+    def test_convert_vips(self, mock_pyvips: MagicMock) -> None:
+        """
+        Test the `convert_vips` method of the `Converter` class.
+
+        This test case replaces pyvips with a fake, and converts an RGB image, which must be saved
+        as is, and a CMYK image with improvement enabled, which must be converted to RGB first and
+        then sharpened and contrast-stretched around the luma mean of its RGB bands.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+            mock_pyvips (MagicMock): The mocked pyvips module.
+
+        Returns:
+            None
+        """
+        png_path: str = os.path.join(self.test_dir.name, "test.png")
+        rgb: MagicMock = MagicMock(interpretation="srgb", bands=3)
+        mock_pyvips.Image.new_from_file.return_value = rgb
+        Converter(self.test_dir.name, backend="vips").convert_vips(self.test_file, png_path)
+        rgb.colourspace.assert_not_called()
+        rgb.pngsave.assert_called_once_with(
+            png_path, compression=1, filter=mock_pyvips.enums.ForeignPngFilter.NONE
+        )
+
+        cmyk: MagicMock = MagicMock(interpretation="cmyk", bands=4)
+        converted: MagicMock = MagicMock(interpretation="srgb", bands=3)
+        cmyk.colourspace.return_value = converted
+        band_means: list[float] = [200.0, 100.0, 50.0]
+        converted.stats.return_value.side_effect = lambda x, y: [band_means[y - 1]]
+        mock_pyvips.Image.new_from_file.return_value = cmyk
+        Converter(self.test_dir.name, improve=True, backend="vips").convert_vips(
+            self.test_file, png_path
+        )
+        cmyk.colourspace.assert_called_once_with("srgb")
+        converted.conv.assert_called_once()
+        mean: int = round(0.299 * 200 + 0.587 * 100 + 0.114 * 50)
+        converted.conv.return_value.linear.assert_called_once_with(
+            1.5, mean * (1 - 1.5), uchar=True
+        )
+        converted.conv.return_value.linear.return_value.pngsave.assert_called_once()
+
+    def test_available_cpu_count(self) -> None:
+        """
+        Test the `available_cpu_count` function.
+
+        This test case checks that the number of usable CPUs is at least 1 and never exceeds
+        the total number of CPUs reported by the operating system.
+
+        Parameters:
+            self (TestJpgToPngConverter): The instance of the test class.
+
+        Returns:
+            None
+        """
+        count: int = available_cpu_count()
+        self.assertGreaterEqual(count, 1)
+        self.assertLessEqual(count, os.cpu_count() or 1)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import os
+import sys
+from typing import Callable
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import numpy as np
+
+from jpg2png import kernels
+from jpg2png.kernels import enhance
+
+
+def _reference(arr: np.ndarray, contrast: float, mean: float) -> np.ndarray:
+    """
+    Compute the expected output of the fused kernel in floating point.
+
+    Args:
+        arr (np.ndarray): uint8 pixel buffer of shape (height, width, channels).
+        contrast (float): Contrast factor.
+        mean (float): Gray level the contrast is scaled around.
+
+    Returns:
+        np.ndarray: Expected uint8 pixel buffer.
+    """
+    pixels: np.ndarray = arr.astype(np.float64)
+    sharpened: np.ndarray = pixels.copy()
+    # Like Pillow's filters, the one pixel wide border is left unsharpened.
+    if arr.shape[0] > 2 and arr.shape[1] > 2:
+        box: np.ndarray = sum(
+            pixels[dy : dy + arr.shape[0] - 2, dx : dx + arr.shape[1] - 2]
+            for dy in range(3)
+            for dx in range(3)
+        )
+        center: np.ndarray = pixels[1:-1, 1:-1]
+        # 2 * img - SMOOTH(img), with SMOOTH = [[1, 1, 1], [1, 5, 1], [1, 1, 1]] / 13.
+        sharpened[1:-1, 1:-1] = 2 * center - (box + 4 * center) / 13
+    sharpened = np.clip(np.floor(sharpened + 0.5), 0, 255)
+    mean = np.floor(mean + 0.5)
+    return np.clip(np.floor(mean + contrast * (sharpened - mean) + 0.5), 0, 255).astype(
+        np.uint8
+    )
+
+
+class TestKernels(unittest.TestCase):
+    """
+    A test suite for the fused pixel kernels used to improve image quality.
+
+    This class checks the integer kernels, compiled or not, against a floating point
+    reference of the sharpen + contrast pipeline.
+    """
+
+    def setUp(self) -> None:
+        """
+        Set up the random pixel buffers and the kernel implementations to test.
+
+        The buffers cover one and three channels, and edge shapes where the whole image is
+        border: 1x1, 2xN and Nx2.
+
+        Parameters:
+            self (TestKernels): The instance of the test class.
+
+        Returns:
+            None
+        """
+        rng: np.random.Generator = np.random.default_rng(0)
+        self.buffers: list[np.ndarray] = [
+            rng.integers(0, 256, size=(height, width, channels), dtype=np.uint8)
+            for height, width in ((1, 1), (2, 7), (7, 2), (3, 3), (9, 13))
+            for channels in (1, 3)
+        ]
+        self.fuse_functions: list[Callable[[np.ndarray, np.ndarray], np.ndarray]] = [
+            kernels._fuse_numpy
+        ]
+        if kernels.njit is not None:
+            self.fuse_functions += [kernels._fuse, kernels._fuse_loops]
+
+    def test_fuse_matches_reference(self) -> None:
+        """
+        Test the fused kernels against the floating point reference.
+
+        This test case runs every kernel implementation on every buffer, for contrast factors
+        below, at and above 1, and asserts that the outputs are identical to the reference.
+
+        Parameters:
+            self (TestKernels): The instance of the test class.
+
+        Returns:
+            None
+        """
+        for contrast in (0.5, 1.0, 1.5, 2.0):
+            for mean in (0, 90, 255):
+                lut: np.ndarray = kernels._enhance_lut(contrast, mean)
+                for arr in self.buffers:
+                    expected: np.ndarray = _reference(arr, contrast, mean)
+                    for fuse in self.fuse_functions:
+                        with self.subTest(
+                            fuse=fuse.__name__, shape=arr.shape, contrast=contrast, mean=mean
+                        ):
+                            np.testing.assert_array_equal(fuse(arr, lut), expected)
+
+    @unittest.skipIf(kernels.njit is None, "numba is not installed")
+    def test_fuse_warm_compiled(self) -> None:
+        """
+        Test that the compiled kernel is warmed up on import for every buffer layout it is used with.
+
+        This test case checks that both writable buffers and read-only buffers, such as the ones
+        returned by the upscalers, already have a compiled specialization.
+
+        Parameters:
+            self (TestKernels): The instance of the test class.
+
+        Returns:
+            None
+        """
+        layouts: set[tuple[str, bool]] = {
+            (signature[0].layout, signature[0].mutable)
+            for signature in kernels._fuse.signatures
+        }
+        self.assertEqual(layouts, {("C", True), ("C", False)})
+
+    def test_enhance(self) -> None:
+        """
+        Test the `enhance` function against the floating point reference.
+
+        This test case enhances two- and three-dimensional buffers, and checks that the output
+        keeps the shape of the input and scales the contrast around its mean gray level.
+
+        Parameters:
+            self (TestKernels): The instance of the test class.
+
+        Returns:
+            None
+        """
+        for arr in self.buffers:
+            channel_means: np.ndarray = arr.mean(axis=(0, 1))
+            mean: float = (
+                float(channel_means @ kernels.LUMA_WEIGHTS)
+                if arr.shape[2] == 3
+                else float(channel_means[0])
+            )
+            expected: np.ndarray = _reference(arr, 1.5, mean)
+            pixels: np.ndarray = arr[:, :, 0] if arr.shape[2] == 1 else arr
+            with self.subTest(shape=pixels.shape):
+                result: np.ndarray = enhance(pixels, 1.5)
+                self.assertEqual(result.shape, pixels.shape)
+                np.testing.assert_array_equal(result, expected.reshape(pixels.shape))
+
+
+if __name__ == "__main__":
+    unittest.main()